@@ -1,10 +1,12 @@
 __version__ = "0.1.0"
 
+import hashlib
 import logging
 import os
+import pickle
 from pathlib import Path
 
-from pydantic_yaml import parse_yaml_file_as
+import msgspec
 
 from surfwetter_ml.config.setting import LibrarySettings
 
@@ -15,6 +17,48 @@ __all__ = [
 ]
 
 logging.basicConfig(format=" %(name)s :: %(levelname)-8s :: %(message)s", level=logging.INFO)
+logger = logging.getLogger(__name__)
 
 ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
-CONFIG = parse_yaml_file_as(LibrarySettings, Path(ROOT_DIR, "config", "config.yaml"))
+CACHE_DIR = Path.home() / ".cache" / "surfwetter_ml"
+
+
+def load_config(config_file: Path) -> LibrarySettings:
+    """Load library settings, re-using a pickled copy of the parsed settings when neither the YAML file nor the settings
+    classes changed. The cached copy is restored without running validation, set `SURFWETTER_VALIDATE_CONFIG` to always
+    validate.
+
+    Parameters
+    ----------
+    config_file : Path
+        Path to the YAML configuration
+
+    Returns
+    -------
+    LibrarySettings
+        Parsed settings
+    """
+    # Structs are pickled by field position, a cache written for other settings classes would load misassigned fields
+    config_hash = hashlib.blake2b(digest_size=16)
+    config_hash.update(config_file.read_bytes())
+    config_hash.update(Path(ROOT_DIR, "config", "setting.py").read_bytes())
+    cache_file = Path(CACHE_DIR, f"config-{config_hash.hexdigest()}-{msgspec.__version__}.pkl")
+    if not os.environ.get("SURFWETTER_VALIDATE_CONFIG") and cache_file.is_file():
+        try:
+            with cache_file.open("rb") as f:
+                return pickle.load(f)  # noqa: S301 - cache is written by ourselves
+        except Exception:
+            logger.warning("Could not read config cache %s, parsing %s", cache_file, config_file)
+
+    settings = msgspec.yaml.decode(config_file.read_bytes(), type=LibrarySettings)
+    try:
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        with cache_file.open("wb") as f:
+            pickle.dump(settings, f)
+    except OSError:
+        logger.warning("Could not write config cache %s", cache_file)
+    return settings
+
+
+CONFIG = load_config(Path(os.environ.get("SURFWETTER_CONFIG", Path(ROOT_DIR, "config", "config.yaml"))))
+PLOT_LOCATIONS = tuple(cfg.location for cfg in CONFIG.plot)
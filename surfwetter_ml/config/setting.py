@@ -1,14 +1,14 @@
 from typing import Any
 
-from pydantic import BaseModel
+import msgspec
 
 
-class SubscriptableBaseModel(BaseModel):
+class SubscriptableStruct(msgspec.Struct):
     def __getitem__(self, item: str) -> Any:
         return getattr(self, item)
 
 
-class RegridSettings(SubscriptableBaseModel):
+class RegridSettings(SubscriptableStruct):
     xmin: float
     xmax: float
     """Longitude bounds for re-gridding"""
@@ -18,7 +18,7 @@ class RegridSettings(SubscriptableBaseModel):
     """Latitude bounds for re-gridding"""
 
 
-class ModelSettings(SubscriptableBaseModel):
+class ModelSettings(SubscriptableStruct):
     name: str
     """The model name as expected by the STAC API"""
 
@@ -35,18 +35,18 @@ class ModelSettings(SubscriptableBaseModel):
     """Model resolution after re-gridding in WGS84"""
 
 
-class ModelList(SubscriptableBaseModel):
+class ModelList(SubscriptableStruct):
     ICON1: ModelSettings
     ICON2: ModelSettings
 
 
-class NWPSettings(SubscriptableBaseModel):
+class NWPSettings(SubscriptableStruct):
     parameters: list[str]
     models: ModelList
     regrid: RegridSettings
 
 
-class TargetSettings(SubscriptableBaseModel):
+class TargetSettings(SubscriptableStruct):
     parameter: str
     """Parameter to predict"""
 
@@ -66,7 +66,7 @@ class TargetSettings(SubscriptableBaseModel):
     """Number of decimals to round data to"""
 
 
-class SiteSettings(SubscriptableBaseModel):
+class SiteSettings(SubscriptableStruct):
     name: str
     """Name of prediction site"""
 
@@ -83,12 +83,12 @@ class SiteSettings(SubscriptableBaseModel):
     """Name of lake in eawag lake simulations"""
 
 
-class ForecastSettings(SubscriptableBaseModel):
+class ForecastSettings(SubscriptableStruct):
     sites: list[SiteSettings]
     targets: list[TargetSettings]
 
 
-class FTPSettings(SubscriptableBaseModel):
+class FTPSettings(SubscriptableStruct):
     host: str
     """FTP host"""
 
@@ -98,14 +98,15 @@ class FTPSettings(SubscriptableBaseModel):
     password: str
     """FTP password"""
 
-class PlotSettings(SubscriptableBaseModel):
+
+class PlotSettings(SubscriptableStruct):
     location: str
     """Location name"""
 
     title: str
     """Title of plot"""
 
-    extent: list[float, float, float, float]
+    extent: tuple[float, float, float, float]
     """Plotting bounds"""
 
     mesh_thres: int
@@ -115,7 +116,15 @@ class PlotSettings(SubscriptableBaseModel):
     """Line threshold for wind gust probabilities"""
 
 
-class LibrarySettings(BaseModel):
+class CacheSettings(SubscriptableStruct):
+    directory: str = ".ekcache"
+    """Location of the download cache, relative paths are resolved against the storage location of NWP data"""
+
+    max_size: str = "20GB"
+    """Size above which the oldest downloads are evicted from the cache"""
+
+
+class LibrarySettings(msgspec.Struct):
     nwp: NWPSettings
     """Settings for NWP data"""
 
@@ -136,3 +145,6 @@ class LibrarySettings(BaseModel):
 
     plot: list[PlotSettings]
     """Settings for plotting"""
+
+    cache: CacheSettings = msgspec.field(default_factory=CacheSettings)
+    """Settings for the cache of downloaded NWP data"""
@@ -12,19 +12,28 @@ import datetime as dt
 import io
 import json
 import logging
+import math
 import os
-import re
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from ftplib import FTP
+from ftplib import all_errors
+from ftplib import error_reply
 from pathlib import Path
 
 import click
+import numba
 import numpy as np
+import orjson
 import pandas as pd
 import pytz
 import requests
 import xarray as xr
 
+from surfwetter_ml import CACHE_DIR
 from surfwetter_ml import CONFIG
+from surfwetter_ml import PLOT_LOCATIONS
 from surfwetter_ml.config.setting import SiteSettings
 from surfwetter_ml.config.setting import TargetSettings
 from surfwetter_ml.plot import plot_ICON1
@@ -33,6 +42,18 @@ from surfwetter_ml.util import write_forecast
 
 logger = logging.getLogger(__name__)
 
+FORECAST_CHUNKS = {"eps": -1, "valid_time": 24}
+"""Dask chunks used to lazily open model forecasts"""
+
+PREDICT_WORKERS = 8
+"""Number of targets processed concurrently"""
+
+FTP_BLOCKSIZE = 1024 * 1024
+"""Block size in bytes used for FTP uploads, large enough to send most files in a single write"""
+
+_REQUIRED_PARAMS = frozenset(CONFIG.nwp.parameters)
+_GRID_POINTS: dict[tuple, list[tuple[int, int]]] = {}
+
 
 @click.command()
 @click.option("--init_icon1", "-i1")
@@ -45,9 +66,14 @@ def predict(init_icon1: str | None = None, init_icon2: str | None = None):
     # Perform pre-processing steps
     pre_process_forecast(init_icon1, init_icon2)
 
-    # Iterate over forecasting sizes
-    for site in CONFIG.forecast.sites:
-        for target in CONFIG.forecast.targets:
+    # Collect sites which still need a forecast for every target
+    init_dir = Path(CONFIG.data, init_icon1)
+    with os.scandir(init_dir) as entries:
+        existing = frozenset(entry.name for entry in entries)
+    pending = []
+    for target in CONFIG.forecast.targets:
+        sites = []
+        for site in CONFIG.forecast.sites:
 
             # Compute PMSL only for pressure difference locations
             if target.parameter == "PMSL" and "QFF" not in site.name:
@@ -57,64 +83,130 @@ def predict(init_icon1: str | None = None, init_icon2: str | None = None):
             if "QFF" in site.name and target.parameter != "PMSL":
                 continue
 
-            # Define file name and check if forecast has already been processed
-            file_name = f"{site.name}-{init_icon1}-{target.parameter}.json"
-            if Path.is_file(Path(CONFIG.data, init_icon1, file_name)):
+            # Check if forecast has already been processed
+            if f"{site.name}-{init_icon1}-{target.parameter}.json" in existing:
                 logging.warning("Prediction %s for %s already exists", target.parameter, site.name)
                 continue
 
-            logging.info("Extracting %s predictions for %s", target.parameter, site.name)
-            icon1_fcst = xr.open_dataset(Path(CONFIG.data, init_icon1, f"ICON1-{init_icon1}-{target.parameter}.nc"))
-            icon2_fcst = xr.open_dataset(Path(CONFIG.data, init_icon2, f"ICON2-{init_icon2}-{target.parameter}.nc"))
-
-            # De-aggregate forecast if needed
-            if target.accumulated:
-                icon1_fcst = icon1_fcst.diff(dim="valid_time", label="lower")
-                icon2_fcst = icon2_fcst.diff(dim="valid_time", label="lower")
+            sites.append(site)
+
+        if sites:
+            pending.append((target, sites))
+
+    # Resolve the grid points of all sites once per model
+    grid_points = {
+        model: locate_sites(model, Path(CONFIG.data, init, f"{model}-{init}-{CONFIG.nwp.parameters[0]}.nc"), CONFIG.forecast.sites)
+        for model, init in (("ICON1", init_icon1), ("ICON2", init_icon2))
+    }
+
+    # Share one FTP connection for all uploads
+    with ftp_session() as ftp_server:
+        # Compute targets concurrently, uploads are done in order over the shared connection
+        valid_times = {}
+        with ThreadPoolExecutor(max_workers=PREDICT_WORKERS) as executor:
+            futures = [(target, executor.submit(process_target, target, sites, init_icon1, init_icon2, grid_points)) for target, sites in pending]
+            for target, future in futures:
+                forecasts = future.result()
+                keep_alive(ftp_server)  # Computing targets takes a while, the server might have closed the idle connection
+                for site_name, forecast in forecasts.items():
+                    upload_forecast(ftp_server, forecast, f"{site_name}-{init_icon1}-{target.parameter}.json")
+                    valid_times[site_name] = forecast.valid_time
+
+            # Load lake forecast only when a lake is defined and if variable forecast exists, requests run concurrently
+            lake_futures = [
+                (site, executor.submit(load_lake_forecast, site.eawag, valid_times[site.name]))
+                for site in CONFIG.forecast.sites
+                if site.eawag and site.name in valid_times
+            ]
+            for site, future in lake_futures:
+                lake_forecast = future.result()
+                keep_alive(ftp_server)
+                upload_forecast(ftp_server, lake_forecast, f"{site.name}-{init_icon1}-laketemp.json")
+
+        # Generate plots
+        logging.info("Plot forecast")
+        for location in PLOT_LOCATIONS:
+            file_name = f"lake_{location}.webp"
+            if file_name in existing:
+                logging.warning("Plot %s already exists", file_name)
+                continue
+            plot_ICON1(init_icon1, location)
+            keep_alive(ftp_server)  # Plotting takes a while, the server might have closed the idle connection
+            upload_file(ftp_server, init_icon1, file_name)
+
+        # Generate aggregated wind forecast
+        daily_forecast = pd.DataFrame()
+        for site in CONFIG.forecast.sites:
+            if "QFF" in site.name:  # Don't attempt to compute daily winds for QFF locations
+                continue
+            daily_forecast = pd.concat([daily_forecast, aggregate_wind(site.name, init_icon1)], axis=1)
 
-            # Compute statistics
-            icon1_quant = compute_quantiles(icon1_fcst, site, target)
-            icon2_quant = compute_quantiles(icon2_fcst, site, target)
+        # Save daily forecast to disk
+        file_name = "DAILY_WIND.json"
+        daily_forecast.to_json(init_dir / file_name)
+        keep_alive(ftp_server)
+        upload_file(ftp_server, init_icon1, file_name)
 
-            # Combine short and mid-term forecast
-            forecast = combine_forecasts(icon1_quant, icon2_quant)
 
-            # Add metadata to forecast
-            forecast = add_metadata(forecast, site, target)
+def process_target(
+    target: TargetSettings,
+    sites: list[SiteSettings],
+    init_icon1: str,
+    init_icon2: str,
+    grid_points: dict[str, dict[str, list[tuple[int, int]]]],
+) -> dict[str, xr.DataArray]:
+    """Compute the combined ICON1 & ICON2 forecast of a target for a list of sites
 
-            # Set timezone to Zurich
-            forecast = set_timezone(forecast, "valid_time")
+    Parameters
+    ----------
+    target : TargetSettings
+        Target to predict
+    sites : list[SiteSettings]
+        Sites to predict target for
+    init_icon1 : str
+        ICON-CH1-EPS initialization
+    init_icon2 : str
+        ICON-CH2-EPS initialization
+    grid_points : dict[str, dict[str, list[tuple[int, int]]]]
+        Grid indices of the sites per model, see `locate_sites`
 
-            # Upload forecast to FTP server
-            upload_forecast(forecast.copy(deep=True), file_name)
+    Returns
+    -------
+    dict[str, xr.DataArray]
+        Forecast per site name
+    """
+    # Open lazily, only the grid points of the sites are read from disk
+    with (
+        xr.open_dataset(
+            Path(CONFIG.data, init_icon1, f"ICON1-{init_icon1}-{target.parameter}.nc"),
+            engine="h5netcdf",
+            chunks=FORECAST_CHUNKS,
+            cache=False,
+        ) as icon1_fcst,
+        xr.open_dataset(
+            Path(CONFIG.data, init_icon2, f"ICON2-{init_icon2}-{target.parameter}.nc"),
+            engine="h5netcdf",
+            chunks=FORECAST_CHUNKS,
+            cache=False,
+        ) as icon2_fcst,
+    ):
+        # Compute statistics for all sites at once
+        logging.info("Extracting %s predictions for %s", target.parameter, ", ".join(site.name for site in sites))
+        icon1_quant = compute_quantiles(icon1_fcst, sites, target, grid_points["ICON1"])
+        icon2_quant = compute_quantiles(icon2_fcst, sites, target, grid_points["ICON2"])
 
-        # Load lake forecast only when a lake is defined and if variable forecast exists
-        if site.eawag and 'forecast' in locals():
-            lake_forecast = load_lake_forecast(site.eawag, forecast.valid_time)
-            upload_forecast(lake_forecast, f"{site.name}-{init_icon1}-laketemp.json")
+    forecasts = {}
+    for site in sites:
+        # Combine short and mid-term forecast
+        forecast = combine_forecasts(icon1_quant.sel(site=site.name, drop=True), icon2_quant.sel(site=site.name, drop=True))
 
-    # Generate plots
-    logging.info("Plot forecast")
-    locations = [cfg.location for cfg in CONFIG.plot]
-    for location in locations:
-        file_name = f"lake_{location}.webp"
-        if Path.is_file(Path(CONFIG.data, init_icon1, file_name)):
-            logging.warning("Plot %s already exists", file_name)
-            continue
-        plot_ICON1(init_icon1, location)
-        upload_file(init_icon1, file_name)
+        # Add metadata to forecast
+        forecast = add_metadata(forecast, site, target)
 
-    # Generate aggregated wind forecast
-    daily_forecast = pd.DataFrame()
-    for site in CONFIG.forecast.sites:
-        if "QFF" in site.name:  # Don't attempt to compute daily winds for QFF locations
-            continue
-        daily_forecast = pd.concat([daily_forecast, aggregate_wind(site.name, init_icon1)], axis=1)
+        # Set timezone to Zurich
+        forecasts[site.name] = set_timezone(forecast, "valid_time")
 
-    # Save daily forecast to disk
-    file_name = "DAILY_WIND.json"
-    daily_forecast.to_json(Path(CONFIG.data, init_icon1, file_name))
-    upload_file(init_icon1, file_name)
+    return forecasts
 
 
 def aggregate_wind(site: str, init: str) -> pd.DataFrame:
@@ -163,47 +255,54 @@ def pre_process_forecast(init_icon1: str, init_icon2: str) -> None:
 
 
 def pre_process_wind(model: str, init: str) -> None:
-    if Path.is_file(Path(CONFIG.data, init, f"{model}-{init}-WIND_DIR.nc")) and Path.is_file(
-        Path(CONFIG.data, init, f"{model}-{init}-WIND_SPEED.nc")
-    ):
+    with os.scandir(Path(CONFIG.data, init)) as entries:
+        present = {entry.name for entry in entries}
+    if f"{model}-{init}-WIND_DIR.nc" in present and f"{model}-{init}-WIND_SPEED.nc" in present:
         logging.warning("Wind for %s init %s is already pre-processed", model, init)
         return
 
     logging.info("Pre-processing wind for %s init %s", model, init)
-    u = xr.open_dataset(Path(CONFIG.data, init, f"{model}-{init}-U_10M.nc"))
-    v = xr.open_dataset(Path(CONFIG.data, init, f"{model}-{init}-V_10M.nc"))
+    init_time = dt.datetime.strptime(init, CONFIG.dtfmt)
+    with (
+        xr.open_dataset(Path(CONFIG.data, init, f"{model}-{init}-U_10M.nc"), engine="h5netcdf") as u,
+        xr.open_dataset(Path(CONFIG.data, init, f"{model}-{init}-V_10M.nc"), engine="h5netcdf") as v,
+    ):
+        # Compute wind direction and speed in a single pass over the fields
+        u_arr = np.ascontiguousarray(u.U_10M.values)
+        v_arr = np.ascontiguousarray(v.V_10M.values)
+        # Fields are stored as float32 anyway, allocate outputs accordingly to limit peak memory
+        wind_dir = np.empty(u_arr.shape, dtype=np.float32)
+        wind_speed = np.empty(u_arr.shape, dtype=np.float32)
+        _uv_to_dir_speed(u_arr.reshape(-1), v_arr.reshape(-1), wind_dir.reshape(-1), wind_speed.reshape(-1))
+
+        # Store wind direction
+        icon_dir = xr.Dataset({"WIND_DIR": (u.U_10M.dims, wind_dir)}, coords=u.coords, attrs=u.attrs)
+        write_forecast(icon_dir, model, "WIND_DIR", init_time)
 
-    # Compute and store wind direction
-    wind_dir = np.degrees(np.arctan2(u.U_10M.values, v.V_10M.values)) % 360
+        # Store wind speed
+        icon_speed = xr.Dataset({"WIND_SPEED": (u.U_10M.dims, wind_speed)}, coords=u.coords, attrs=u.attrs)
+        write_forecast(icon_speed, model, "WIND_SPEED", init_time)
 
-    # Flip direction
-    wind_dir = np.where(wind_dir > 180, wind_dir - 180, 360 + (wind_dir - 180))
-    icon_dir = xr.zeros_like(u)
-    icon_dir["WIND_DIR"] = (icon_dir.dims, wind_dir)
-    icon_dir = icon_dir.drop_vars("U_10M")
-    write_forecast(icon_dir, model, "WIND_DIR", dt.datetime.strptime(init, CONFIG.dtfmt))
 
-    # Compute and store wind speed
-    wind_speed = np.sqrt((u.U_10M.values) ** 2 + (v.V_10M.values) ** 2)
-    icon_speed = xr.zeros_like(u)
-    icon_speed["WIND_SPEED"] = (icon_speed.dims, wind_speed)
-    icon_speed = icon_speed.drop_vars("U_10M")
-    write_forecast(icon_speed, model, "WIND_SPEED", dt.datetime.strptime(init, CONFIG.dtfmt))
+@numba.njit(parallel=True, cache=True)
+def _uv_to_dir_speed(u: np.ndarray, v: np.ndarray, wind_dir: np.ndarray, wind_speed: np.ndarray) -> None:
+    """Fused kernel computing the (flipped) wind direction and wind speed of flat wind component arrays"""
+    for i in numba.prange(u.size):
+        # atan2 is within [-180, 180], wrapping to [0, 360) and flipping by 180 degrees reduces to a single shift
+        wind_dir[i] = math.degrees(math.atan2(u[i], v[i])) + 180.0
+        wind_speed[i] = math.hypot(u[i], v[i])
 
 
 def combine_forecasts(icon1: xr.DataArray, icon2: xr.DataArray) -> xr.DataArray:
     icon1_valid = icon1.valid_time.values
     icon2_valid = icon2.valid_time.values
     combined_valid_time = np.intersect1d(icon1_valid, icon2_valid)
-    icon2_select = np.setxor1d(combined_valid_time, icon2_valid)
+    icon2_select = np.setdiff1d(icon2_valid, combined_valid_time, assume_unique=True)
 
     # Compute weighted averages for the last 3 hours of overlap (25%, 50%, 75%)
-    overlap = []
-    weights = [0.25, 0.5, 0.75]
-    for i, overlap_time in enumerate(combined_valid_time[-3:]):
-        overlap.append(icon1.sel(valid_time=overlap_time) * (1 - weights[i]) + icon2.sel(valid_time=overlap_time) * weights[i])
-
-    overlap_da = xr.concat(overlap, dim="valid_time")
+    overlap_times = combined_valid_time[-3:]
+    weights = xr.DataArray(np.array([0.25, 0.5, 0.75], dtype=np.float32), dims="valid_time", coords={"valid_time": overlap_times})
+    overlap_da = icon1.sel(valid_time=overlap_times) * (1 - weights) + icon2.sel(valid_time=overlap_times) * weights
     return xr.concat([icon1.sel(valid_time=icon1_valid[:-3]), overlap_da, icon2.sel(valid_time=icon2_select)], dim="valid_time")
 
 
@@ -232,11 +331,50 @@ def add_metadata(forecast: xr.DataArray, site: SiteSettings, target: TargetSetti
     return forecast
 
 
-def upload_forecast(forecast: xr.DataArray, file_name: str) -> None:
+@contextmanager
+def ftp_session() -> Iterator[FTP]:
+    """Open a connection to the FTP server which is re-used for all uploads and closed on exit
+
+    Yields
+    ------
+    FTP
+        Connected FTP session
+    """
+    ftp_server = FTP(CONFIG.ftp.host, CONFIG.ftp.user, CONFIG.ftp.password)
+    ftp_server.set_pasv(True)
+    try:
+        yield ftp_server
+    finally:
+        try:
+            ftp_server.quit()
+        except (OSError, error_reply):
+            ftp_server.close()
+
+
+def keep_alive(ftp_server: FTP) -> None:
+    """Check that the shared FTP session is still open and log in again if the server closed it
+
+    Parameters
+    ----------
+    ftp_server : FTP
+        FTP session to check
+    """
+    try:
+        ftp_server.voidcmd("NOOP")
+    except all_errors:
+        logger.info("FTP connection was closed, reconnecting")
+        ftp_server.close()  # Release the socket and file of the dead connection before connect replaces them
+        ftp_server.connect(CONFIG.ftp.host)
+        ftp_server.login(CONFIG.ftp.user, CONFIG.ftp.password)
+
+
+def upload_forecast(ftp_server: FTP, forecast: xr.DataArray, file_name: str) -> None:
     """Convert forecast from xarray to JSON and upload bytes to FTP server. Additionally, store JSON file locally
 
     Parameters
     ----------
+    ftp_server : FTP
+        Open FTP session
     forecast : xr.DataArray
         Dataarray holding the forecast
     file_name : str
@@ -245,73 +383,122 @@ def upload_forecast(forecast: xr.DataArray, file_name: str) -> None:
 
     logger.info("Uploading %s to FTP server...", file_name)
 
-    # Define time format
-    forecast["valid_time"] = forecast.valid_time.data.strftime("%Y-%m-%dT%H:%M:%S")
+    # Define time format, format local times as ISO strings without offset
+    local_times = forecast.valid_time.to_index().tz_localize(None).values
+    forecast = forecast.assign_coords(valid_time=np.datetime_as_string(local_times, unit="s"))
 
-    # Convert forecast to JSON
-    forecast_dict = forecast.to_dict()
-    forecast_json = json.dumps(forecast_dict)
-
-    # Convert forecast to xml bytes
-    forecast_bytes = io.BytesIO()
-    forecast_bytes.write(forecast_json.encode())
-    forecast_bytes.seek(0)
+    # Convert forecast to JSON bytes, numeric arrays are serialized directly without creating Python floats
+    payload = orjson.dumps(
+        forecast.to_dict(data="array"), option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY, default=_array_to_list
+    )
 
     # Store files also locally
-    with Path.open(Path(CONFIG.data, file_name.split("-")[1], file_name), "w") as f:
-        f.write(forecast_json)
+    init = file_name.split("-")[1]
+    Path(CONFIG.data, init, file_name).write_bytes(payload)
 
-    date_str = re.search("[0-9]{10}-", file_name)
-    remote_fn = file_name.replace(date_str[0], "")
+    # Remove init from remote file name
+    remote_fn = file_name.replace(f"{init}-", "", 1)
+
+    # Upload forecast
+    ftp_server.storbinary(f"STOR {remote_fn}", io.BytesIO(payload), blocksize=FTP_BLOCKSIZE)
 
-    # Connect to server and upload forecast
-    ftp_server = FTP(CONFIG.ftp.host, CONFIG.ftp.user, CONFIG.ftp.password)
-    ftp_server.storbinary(f"STOR {remote_fn}", forecast_bytes)
 
-    # Close the Connection
-    ftp_server.quit()
+def _array_to_list(obj: object) -> list:
+    """Fallback for arrays orjson cannot serialize natively, e.g. arrays of strings"""
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    raise TypeError
 
 
-def upload_file(model_init: str, fname: str = "lake_lucerne.webp") -> None:
+def upload_file(ftp_server: FTP, model_init: str, fname: str = "lake_lucerne.webp") -> None:
     # Upload image
-    ftp_server = FTP(CONFIG.ftp.host, CONFIG.ftp.user, CONFIG.ftp.password)
     with Path.open(Path(CONFIG.data, model_init, fname), "rb") as file:
-        ftp_server.storbinary(f"STOR {fname}", file)
-    ftp_server.quit()
+        ftp_server.storbinary(f"STOR {fname}", file, blocksize=FTP_BLOCKSIZE)
 
 
 def lookup_latest_forecast() -> tuple[str, str]:
-    """Find the latest fully downloaded forecasts for ICON1 & ICON2
+    """Find the latest fully downloaded forecasts for ICON1 & ICON2. The result of the last scan is re-used
+    as long as neither the data directory nor any forecast folder at or after the found inits changed.
 
     Returns
     -------
     tuple[str, str]
         Folder with forecasts
     """
-
-    # List all folders in data directory
-    folders = os.listdir(CONFIG.data)
-
-    # Only keep folders that follow the pattern YYYYMMDDHH
-    pattern = re.compile("[0-9]{10}")
-    folders = [folder for folder in folders if pattern.match(folder)]
-    folders.sort(reverse=True)
+    cache_file = Path(CACHE_DIR, "latest.json")
+    data_mtime = Path(CONFIG.data).stat().st_mtime_ns
+    try:
+        cache = orjson.loads(cache_file.read_bytes())
+        if (
+            cache["data"] == CONFIG.data
+            and cache["mtime"] == data_mtime
+            and all(Path(CONFIG.data, folder).stat().st_mtime_ns == mtime for folder, mtime in cache["folders"].items())
+        ):
+            logging.info("Latest forecasts ICON1: %s ICON2: %s (cached)", cache["init_icon1"], cache["init_icon2"])
+            return cache["init_icon1"], cache["init_icon2"]
+    except (OSError, KeyError, orjson.JSONDecodeError):
+        logging.debug("No valid cache of latest forecasts")
+
+    # List all folders in data directory named after a model initialization
+    with os.scandir(CONFIG.data) as entries:
+        folders = sorted((entry.name for entry in entries if is_init_folder(entry.name) and entry.is_dir()), reverse=True)
 
     # Check if all requried files are available
     init_icon1 = ""
     init_icon2 = ""
+    mtimes = {}
     for folder in folders:
-        files = os.listdir(Path(CONFIG.data, folder))
+        folder_dir = Path(CONFIG.data, folder)
+        mtimes[folder] = folder_dir.stat().st_mtime_ns
+        with os.scandir(folder_dir) as entries:
+            files = [entry.name for entry in entries]
         if init_icon2 == "" and match_files("ICON2", files):
             init_icon2 = folder
         if init_icon1 == "" and match_files("ICON1", files):
             init_icon1 = folder
+        if init_icon1 and init_icon2:
+            break
 
     logging.info("Latest forecasts ICON1: %s ICON2: %s", init_icon1, init_icon2)
 
+    # Remember folder modification times, files added to older folders cannot change the result
+    oldest = min(init_icon1, init_icon2) if init_icon1 and init_icon2 else ""
+    cache = {
+        "data": CONFIG.data,
+        "mtime": data_mtime,
+        "folders": {folder: mtime for folder, mtime in mtimes.items() if folder >= oldest},
+        "init_icon1": init_icon1,
+        "init_icon2": init_icon2,
+    }
+    try:
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        cache_file.write_bytes(orjson.dumps(cache))
+    except OSError:
+        logging.warning("Could not write cache of latest forecasts %s", cache_file)
+
     return init_icon1, init_icon2
 
 
+def is_init_folder(name: str) -> bool:
+    """Check if a folder is named after a model initialization formatted with `CONFIG.dtfmt`
+
+    Parameters
+    ----------
+    name : str
+        Folder name
+
+    Returns
+    -------
+    bool
+        Whether the folder holds forecasts of a model initialization
+    """
+    try:
+        # strptime accepts fields without zero padding, only a round trip ensures the name follows the format
+        return dt.datetime.strptime(name, CONFIG.dtfmt).replace(tzinfo=dt.UTC).strftime(CONFIG.dtfmt) == name
+    except ValueError:
+        return False
+
+
 def match_files(model: str, files: list) -> bool:
     """Check if required forecast parameters are available in directory
 
@@ -327,44 +514,153 @@ def match_files(model: str, files: list) -> bool:
     bool
         Whether all files are available or not
     """
-    icon1_files = [file for file in files if file.startswith(model)]
-    icon1_params = [file.split("-")[-1].replace(".nc", "") for file in icon1_files]  # Get list of parameters, remove trailing .nc
-    if set(icon1_params) >= set(CONFIG.nwp.parameters):
-        return True
-    else:
-        return False
+    missing = set(_REQUIRED_PARAMS)
+    for file in files:
+        if file.startswith(model):
+            missing.discard(file.rsplit("-", 1)[-1].removesuffix(".nc"))  # Get parameter, remove trailing .nc
+            if not missing:
+                return True
+    return False
+
+
+def locate_sites(model: str, grid_file: Path, sites: list[SiteSettings]) -> dict[str, list[tuple[int, int]]]:
+    """Find the indices of the grid points nearest to the sites. The model grids are fixed by the re-gridding
+    settings, hence results are kept for the lifetime of the process
+
+    Parameters
+    ----------
+    model : str
+        Model name, either 'ICON1' or 'ICON2'
+    grid_file : Path
+        Any forecast file of the model providing the `lon` and `lat` coordinates
+    sites : list[SiteSettings]
+        Site settings with `name`, `lon` and `lat` attributes
 
+    Returns
+    -------
+    dict[str, list[tuple[int, int]]]
+        Longitude and latitude index of every location of a site, keyed by site name
+    """
+    keys = {site.name: _grid_point_key(model, site) for site in sites}
+    missing = [site for site in sites if keys[site.name] not in _GRID_POINTS]
+    if missing:
+        with xr.open_dataset(grid_file, engine="h5netcdf") as grid:
+            lon_index = grid.indexes["lon"]
+            lat_index = grid.indexes["lat"]
 
-def compute_quantiles(data: xr.Dataset, site: SiteSettings, target: TargetSettings) -> xr.DataArray:
-    """Extract parameter at required station and compute quantiles from forecast ensemble
+        # Resolve ties between two grid points like `sel(method="nearest")`
+        for site in missing:
+            lons, lats = keys[site.name][-2:]
+            ilons = lon_index.get_indexer(lons, method="nearest")
+            ilats = lat_index.get_indexer(lats, method="nearest")
+            _GRID_POINTS[keys[site.name]] = [(int(ilon), int(ilat)) for ilon, ilat in zip(ilons, ilats, strict=True)]
+
+    return {site.name: _GRID_POINTS[keys[site.name]] for site in sites}
+
+
+def _grid_point_key(model: str, site: SiteSettings) -> tuple:
+    """Build the cache key of the grid points of a site from the model grid and the site locations, so that
+    changed settings never reuse stale indices
+
+    Parameters
+    ----------
+    model : str
+        Model name, either 'ICON1' or 'ICON2'
+    site : SiteSettings
+        Site settings with `name`, `lon` and `lat` attributes
+
+    Returns
+    -------
+    tuple
+        Model grid bounds and distance followed by the site name, longitudes and latitudes
+    """
+    bounds = CONFIG.nwp.regrid
+    lons = tuple(site.lon) if isinstance(site.lon, list) else (site.lon,)
+    lats = tuple(site.lat) if isinstance(site.lat, list) else (site.lat,)
+    return (model, bounds.xmin, bounds.xmax, bounds.ymin, bounds.ymax, CONFIG.nwp.models[model].distance, site.name, lons, lats)
+
+
+def compute_quantiles(
+    data: xr.Dataset, sites: list[SiteSettings], target: TargetSettings, grid_points: dict[str, list[tuple[int, int]]]
+) -> xr.DataArray:
+    """Extract parameter at all required stations and compute quantiles from forecast ensemble
 
     Parameters
     ----------
     data : xr.Dataset
         Model forecast ensemble
-    site : SiteSettings
-        Site settings with `lon` and `lat` attributes
+    sites : list[SiteSettings]
+        Site settings with `name` attribute
     target : TargetSettings
         Target settings with information about quantiles to compute
+    grid_points : dict[str, list[tuple[int, int]]]
+        Grid indices of the sites, see `locate_sites`
 
     Returns
     -------
     xr.DataArray
-        Requested quantiles of parameter extracted at required station
+        Requested quantiles of parameter extracted at required stations along the `site` dimension
+    """
+    logger.debug("Extracting %s for %s", target.parameter, ", ".join(site.name for site in sites))
+    names = [site.name for site in sites]
+
+    # Select all sites at once, for pressure difference locations start with the first location
+    ilon = xr.DataArray([grid_points[name][0][0] for name in names], dims="site", coords={"site": names})
+    ilat = xr.DataArray([grid_points[name][0][1] for name in names], dims="site", coords={"site": names})
+    local_forecast = data[target.parameter].isel(lon=ilon, lat=ilat)
+
+    # Subtract members at second location such that quantile computation works correctly
+    diff_names = [name for name in names if len(grid_points[name]) > 1]
+    if diff_names:
+        ilon = xr.DataArray([grid_points[name][1][0] for name in diff_names], dims="site", coords={"site": diff_names})
+        ilat = xr.DataArray([grid_points[name][1][1] for name in diff_names], dims="site", coords={"site": diff_names})
+        location_2 = data[target.parameter].isel(lon=ilon, lat=ilat)
+        local_forecast = local_forecast - location_2.reindex(site=names, fill_value=0)
+
+    # Only load the selected grid points into memory
+    local_forecast = local_forecast.load().reset_coords(drop=True)
+
+    # De-aggregate forecast if needed
+    if target.accumulated:
+        deaggregated = np.diff(local_forecast.values, axis=local_forecast.get_axis_num("valid_time"))
+        local_forecast = local_forecast.isel(valid_time=slice(None, -1)).copy(data=deaggregated)
+
+    # Sort the ensemble once for all quantiles
+    statistics = xr.apply_ufunc(
+        ensemble_quantiles,
+        local_forecast,
+        input_core_dims=[["eps"]],
+        output_core_dims=[["quantile"]],
+        kwargs={"quantiles": target.quantiles},
+    )
+    return statistics.assign_coords(quantile=target.quantiles).transpose("quantile", ...).round(target.nround)
+
+
+def ensemble_quantiles(data: np.ndarray, quantiles: list[float]) -> np.ndarray:
+    """Compute quantiles along the last axis ignoring NaNs, equivalent to `np.nanquantile` with linear interpolation
+    but sorting the members only once for all quantiles and without looping over the other axes
+
+    Parameters
+    ----------
+    data : np.ndarray
+        Ensemble members along the last axis
+    quantiles : list[float]
+        Quantiles to compute
+
+    Returns
+    -------
+    np.ndarray
+        Quantiles along the last axis
     """
-    logger.debug("Extracting %s for %s at lon: %s, lat: %s", target.parameter, site.name, site.lon, site.lat)
-    if isinstance(site.lon, list):
-        location_1 = data[target.parameter].sel(lon=site.lon[0], lat=site.lat[0], method="nearest")  # Get first location
-        location_2 = data[target.parameter].sel(lon=site.lon[1], lat=site.lat[1], method="nearest")  # Get second location
-        local_forecast = location_1 - location_2  # Subtract members at locations such that quantile computation works correctly
-    else:
-        local_forecast = data[target.parameter].sel(lon=site.lon, lat=site.lat, method="nearest")  # Select location and parameter
-    statistics = []
-    for quantile in target.quantiles:
-        local_statistic = local_forecast.quantile(q=quantile, dim="eps").round(target.nround)
-        statistics.append(local_statistic)
-
-    return xr.concat(statistics, dim="quantile")
+    sorted_data = np.sort(data, axis=-1)  # NaNs are sorted to the end
+    count = np.count_nonzero(~np.isnan(data), axis=-1, keepdims=True)
+    position = np.maximum(count - 1, 0) * np.asarray(quantiles)
+    lower = np.floor(position).astype(np.intp)
+    upper = np.minimum(lower + 1, np.maximum(count - 1, 0))
+    fraction = position - lower
+    lower_value = np.take_along_axis(sorted_data, lower, axis=-1)
+    upper_value = np.take_along_axis(sorted_data, upper, axis=-1)
+    return np.where(count > 0, lower_value + (upper_value - lower_value) * fraction, np.nan)
 
 
 def load_lake_forecast(lake: str, dates: xr.DataArray) -> xr.Dataset:
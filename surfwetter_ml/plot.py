@@ -1,16 +1,20 @@
 import datetime as dt
+import functools
 import logging
-import os
-import subprocess
+from pathlib import Path
 
 import cartopy.crs as ccrs
 import cartopy.feature as cfeature
 import click
 import geopandas as gpd
 import matplotlib.pyplot as plt
+import numba
 import numpy as np
+import shapely
 import xarray as xr
 from cartopy.mpl.geoaxes import GeoAxes
+from matplotlib.artist import Artist
+from matplotlib.figure import Figure
 from matplotlib.lines import Line2D
 from matplotlib.patches import Patch
 
@@ -19,104 +23,132 @@ from surfwetter_ml.util import set_timezone
 
 logger = logging.getLogger(__name__)
 
+# Share projections across all plots, creating them is expensive
+_PC = ccrs.PlateCarree()
+_MERC = ccrs.Mercator()
+
+# Coordinates of all surf spots, sites with two locations contribute both
+_SITE_LONS = np.hstack([site.lon for site in CONFIG.forecast.sites])
+_SITE_LATS = np.hstack([site.lat for site in CONFIG.forecast.sites])
+
 
 def plot_ICON1(forecast: str, location: str) -> None:
     logger.info("Plotting lake %s for %s", location, forecast)
     title, extent, mesh_thres, line_thres = get_plot_settings(location)
 
-    gusts = xr.open_dataset(f"{CONFIG.data}/{forecast}/ICON1-{forecast}-VMAX_10M.nc")
-    gusts["VMAX_10M"] = gusts["VMAX_10M"] * 1.944  # convert windspeed from m/s to knots
+    # Only read the extent of the plot to speed up processing and plotting
+    roi = {"lat": slice(extent[2] - 0.1, extent[3] + 0.1), "lon": slice(extent[0] - 0.1, extent[1] + 0.1)}
+
+    gusts = open_forecast(forecast, "VMAX_10M").sel(roi).load()
+    gusts["VMAX_10M"] *= 1.944  # convert windspeed from m/s to knots in-place
 
     # Load rain
-    rain = xr.open_dataset(f"{CONFIG.data}/{forecast}/ICON1-{forecast}-TOT_PREC.nc")
-    rain_t0 = rain.isel(valid_time=0)
-    rain_diff = rain.diff(dim="valid_time", label="upper")
-    rain = xr.concat([rain_t0, rain_diff], dim='valid_time')
+    rain = open_forecast(forecast, "TOT_PREC").sel(roi)
+    accumulated = rain.TOT_PREC.transpose("valid_time", ...)
+    values = accumulated.values
+    hourly = np.empty_like(values)
+    hourly[0] = values[0]
+    np.subtract(values[1:], values[:-1], out=hourly[1:])
+    rain["TOT_PREC"] = accumulated.copy(data=hourly)
 
     # Convert to local time
     gusts = set_timezone(gusts, "valid_time")
     rain = set_timezone(rain, "valid_time")
 
-    # Compute probability to exceed 14 and 24 knots
-    exceed_14 = xr.where(gusts.VMAX_10M >= mesh_thres, 1, 0)
-    prob_14 = exceed_14.sum(dim="eps") / 11
-    exceed_20 = xr.where(gusts.VMAX_10M >= line_thres, 1, 0)
-    prob_20 = exceed_20.sum(dim="eps") / 11
-
-    # Reduce size of data to speed up plotting
-    prob_14 = prob_14.sel(lat=slice(extent[2] - 0.1, extent[3] + 0.1), lon=slice(extent[0] - 0.1, extent[1] + 0.1))
-    prob_20 = prob_20.sel(lat=slice(extent[2] - 0.1, extent[3] + 0.1), lon=slice(extent[0] - 0.1, extent[1] + 0.1))
-    rain_median = rain.TOT_PREC.median(dim="eps").sel(
-        lat=slice(extent[2] - 0.1, extent[3] + 0.1), lon=slice(extent[0] - 0.1, extent[1] + 0.1)
-    )
+    # Lead-times are selected by position below, gusts are read from the plot mirror and rain from the forecast file
+    if not np.array_equal(rain.valid_time, gusts.valid_time):
+        raise ValueError(f"Rain and gust forecasts of {forecast} cover different valid times, the plot mirror may be incomplete")
+
+    # Compute probability to exceed 14 and 24 knots in a single pass over the ensemble
+    gusts_knots = np.ascontiguousarray(gusts.VMAX_10M.transpose("valid_time", "eps", "lat", "lon").values)
+    exceed_mesh, exceed_line = _exceedance_probabilities(gusts_knots, mesh_thres, line_thres)
+    prob_coords = {"valid_time": gusts.valid_time, "lat": gusts.lat, "lon": gusts.lon}
+    prob_14 = xr.DataArray(exceed_mesh, coords=prob_coords, dims=("valid_time", "lat", "lon"))
+    prob_20 = xr.DataArray(exceed_line, coords=prob_coords, dims=("valid_time", "lat", "lon"))
+    rain_median = rain.TOT_PREC.median(dim="eps")
+
+    # Project the grid once, so cartopy does not need to transform every contour of every lead-time
+    lon_mesh, lat_mesh = np.meshgrid(prob_14.lon.data, prob_14.lat.data)
+    projected = _MERC.transform_points(_PC, lon_mesh, lat_mesh)
+    projected_coords = {"x_merc": (("lat", "lon"), projected[..., 0]), "y_merc": (("lat", "lon"), projected[..., 1])}
+    prob_14 = prob_14.assign_coords(projected_coords)
+    prob_20 = prob_20.assign_coords(projected_coords)
+    rain_median = rain_median.assign_coords(projected_coords)
 
     # Define offset for lead-time, number of rows and coloums and figure height depending on model init
     # For early runs (and very late runs) start plots at 9AM
     if gusts.valid_time.data.hour[0] <= 8 or gusts.valid_time.data.hour[0] >= 17:
-        lt_offset = np.where(exceed_14.valid_time.data.hour == 10)[0][0]
+        lt_offset = np.where(gusts.valid_time.data.hour == 10)[0][0]
         ncols, nrows = 3, 3
         figheight = 18
     elif gusts.valid_time.data.hour[0] <= 11:  # otherwise at 12AM
-        lt_offset = np.where(exceed_14.valid_time.data.hour == 11)[0][0]
+        lt_offset = np.where(gusts.valid_time.data.hour == 11)[0][0]
         ncols, nrows = 3, 3
         figheight = 18
     elif gusts.valid_time.data.hour[0] <= 14:  # or at 3PM
-        lt_offset = np.where(exceed_14.valid_time.data.hour == 14)[0][0]
+        lt_offset = np.where(gusts.valid_time.data.hour == 14)[0][0]
         ncols, nrows = 2, 3
         figheight = 14
 
-    # Initialize figure
+    # Load lakes within view once for all lead-times
+    lakes = load_lakes(tuple(extent))
+
+    # Initialize figure, re-using the figure of a previous plot with the same layout
     plt.rcParams.update({"font.size": 15})
-    fig = plt.figure(figsize=(30, figheight))  # width, height
     naxs = ncols * nrows
-    axs = naxs * [GeoAxes]
+    fig, axs, annotations = get_figure(figheight, naxs)
+
+    # Select the plotted lead-times once, load them and convert to percentages
+    plot_steps = slice(lt_offset, lt_offset + naxs)
+    prob_14 = (prob_14.isel(valid_time=plot_steps) * 100).load()
+    prob_20 = (prob_20.isel(valid_time=plot_steps) * 100).load()
+    rain_median = rain_median.isel(valid_time=plot_steps).transpose("valid_time", ...).load()
 
     # Iterate over lead-times
     for idx in range(naxs):
-        # Select data and convert to probabilities
-        plot_gusts_14 = prob_14.isel(valid_time=(idx + lt_offset)) * 100
-        plot_gusts_20 = prob_20.isel(valid_time=(idx + lt_offset)) * 100
+        # Select data of lead-time
+        plot_gusts_14 = prob_14[idx]
+        plot_gusts_20 = prob_20[idx]
         plot_time = gusts.valid_time.data[idx + lt_offset]
-        plot_rain = rain_median.sel(valid_time=plot_time)
-
-        # Initialize plot
-        axs[idx] = fig.add_subplot(3, 3, idx + 1, projection=ccrs.Mercator())  # slow AF
-        # axs[idx] = fig.add_subplot(3, 3, idx + 1, projection=ccrs.PlateCarree())
+        plot_rain = rain_median[idx]
 
         # Plot 14 knots gusts probabilities
-        im = plot_gusts_14.plot(
-            ax=axs[idx], cmap="CMRmap_r", levels=np.arange(10, 100, 10), transform=ccrs.PlateCarree(), add_colorbar=False
+        im = plot_gusts_14.plot.pcolormesh(
+            ax=axs[idx],
+            x="x_merc",
+            y="y_merc",
+            cmap="CMRmap_r",
+            levels=np.arange(10, 100, 10),
+            transform=_MERC,
+            add_colorbar=False,
+            shading="nearest",
         )
 
         # Overlay 20 knots gust probabilities
         plot_gusts_20.plot.contour(
-            ax=axs[idx], levels=np.array([25, 50, 75]), transform=ccrs.PlateCarree(), cmap="winter", add_colorbar=False
+            ax=axs[idx], x="x_merc", y="y_merc", levels=np.array([25, 50, 75]), transform=_MERC, cmap="winter", add_colorbar=False
         )
 
         # Add contours for rain
         plot_rain.plot.contourf(
             ax=axs[idx],
+            x="x_merc",
+            y="y_merc",
             levels=np.array([0, 1]),
             hatches=["", ".."],
-            transform=ccrs.PlateCarree(),
+            transform=_MERC,
             colors=["none", "#3a40e880"],
             add_colorbar=False,
         )
         # rain_contours.set_edgecolor("red")
 
         axs[idx].title.set_text(f"{plot_time.strftime('%d.%m.%Y %H:%M')}LT T+{idx + lt_offset}h")
-        add_overlay(axs[idx], extent)
-
-    # Adjust padding
-    fig.subplots_adjust(top=0.95, bottom=0.08, wspace=0.02, hspace=0.02)
+        add_overlay(axs[idx], extent, lakes)
 
     # Add labels, colorbar, and annotate plot
     cbar_ax = fig.add_axes([0.36, 0.05, 0.3, 0.03])  # left, bottom, weight, height
     fig.colorbar(mappable=im, cax=cbar_ax, location="bottom", label=f"Böen > {mesh_thres} Knoten (%)")
-    fig.legend(
-        handles=[Patch(color="#3a40e880", hatch=".", label=">1mm Regen")], loc="upper left", bbox_to_anchor=(0.2, 0.98), frameon=False
-    )
-    fig.legend(
+    line_legend = fig.legend(
         handles=[
             Line2D([0], [0], color="#0000ff", lw=1, label="25%"),
             Line2D([0], [0], color="#007fbf", lw=1, label="50%"),
@@ -128,19 +160,127 @@ def plot_ICON1(forecast: str, location: str) -> None:
         frameon=False,
         title=f"Wahrscheinlichkeit Böen > {line_thres} Knoten",
     )
+    run_text = fig.text(0.9, 0.07, f"ICON-CH1-EPS Modellauf {gusts.valid_time[0].dt.strftime('%d.%m.%Y %H:%M').data} UTC", ha="right")
+    annotations.extend([cbar_ax, line_legend, run_text])
+    fig.suptitle(title, weight="bold", size=25)
+    fig.savefig(f"{CONFIG.data}/{forecast}/lake_{location}.webp", dpi=150, bbox_inches="tight", pil_kwargs={"quality": 80, "method": 4})
+
+
+_FIGURES: dict[int, tuple[Figure, list[GeoAxes], list[Artist]]] = {}
+"""Figures by height with their lead-time axes and the annotations specific to the last plot"""
+
+
+def get_figure(figheight: int, naxs: int) -> tuple[Figure, list[GeoAxes], list[Artist]]:
+    """Get a figure with empty lead-time axes and the annotations shared by all plots, figures are re-used across plots
+
+    Parameters
+    ----------
+    figheight : int
+        Height of the figure
+    naxs : int
+        Number of lead-time axes
+
+    Returns
+    -------
+    tuple[Figure, list[GeoAxes], list[Artist]]
+        Figure, lead-time axes and list to register plot specific annotations to remove on re-use
+    """
+    if figheight in _FIGURES:
+        fig, axs, annotations = _FIGURES[figheight]
+        for artist in annotations:
+            artist.remove()
+        annotations.clear()
+        for ax in axs:
+            ax.cla()
+        return fig, axs, annotations
 
+    fig = plt.figure(figsize=(30, figheight))  # width, height
+    axs = [fig.add_subplot(3, 3, idx + 1, projection=_MERC) for idx in range(naxs)]
+
+    # Adjust padding
+    fig.subplots_adjust(top=0.95, bottom=0.08, wspace=0.02, hspace=0.02)
+
+    # Add annotations which are the same for all plots
+    fig.legend(
+        handles=[Patch(color="#3a40e880", hatch=".", label=">1mm Regen")], loc="upper left", bbox_to_anchor=(0.2, 0.98), frameon=False
+    )
     fig.text(0.9, 0.05, "Datenquelle: MeteoSchweiz", ha="right")
     fig.text(0.13, 0.05, "surfwetter.ch", ha="left", weight="bold", size="30", alpha=0.5)
-    fig.text(0.9, 0.07, f"ICON-CH1-EPS Modellauf {gusts.valid_time[0].dt.strftime('%d.%m.%Y %H:%M').data} UTC", ha="right")
-    fig.suptitle(title, weight="bold", size=25)
-    fig.savefig(f"{CONFIG.data}/{forecast}/lake_{location}.png", dpi=150, bbox_inches="tight")
 
-    # Make systemcall to convert to webp...
-    os.chdir(f"{CONFIG.data}/{forecast}")
-    subprocess.run(["cwebp", "-q", "80", f"lake_{location}.png", "-o", f"lake_{location}.webp"])
+    _FIGURES[figheight] = fig, axs, []
+    return _FIGURES[figheight]
+
+
+@functools.lru_cache(maxsize=4)
+def open_forecast(forecast: str, param: str) -> xr.Dataset:
+    """Lazily open an ICON1 forecast, shared by the plots of all locations
+
+    Parameters
+    ----------
+    forecast : str
+        Model initialization
+    param : str
+        Forecast parameter
+
+    Returns
+    -------
+    xr.Dataset
+        Forecast, only the selected parts are read from disk
+    """
+    # Prefer the coarsely packed copy stored for plotting
+    file_name = Path(CONFIG.data, forecast, f"ICON1-{forecast}-{param}.plot.nc")
+    if not file_name.is_file():
+        file_name = file_name.with_name(f"ICON1-{forecast}-{param}.nc")
+    return xr.open_dataset(file_name, engine="h5netcdf", chunks=None, cache=True, decode_timedelta=False)
+
+
+@functools.cache
+def read_lakes() -> gpd.GeoDataFrame:
+    """Read the lake outlines and build their spatial index once per process"""
+    lakes = gpd.read_file("/home/roman/projects/surfwetter-ml/src/lakes")
+    _ = lakes.sindex
+    return lakes
+
 
+@functools.lru_cache(maxsize=8)
+def load_lakes(extent: tuple[float, float, float, float]) -> list:
+    """Load the lake outlines within the extent of a plot
 
-def add_overlay(ax, extent: list):
+    Parameters
+    ----------
+    extent : tuple[float, float, float, float]
+        Extent with coordinates west, east, south, north
+
+    Returns
+    -------
+    list
+        Lake geometries, empty if there are no lakes within the extent
+    """
+    # Filter within view to speed up rendering, a query without predicate keeps every lake whose bounding box
+    # intersects the view like `cx` but uses the spatial index instead of testing every lake
+    lakes = read_lakes()
+    within_bound = lakes.sindex.query(shapely.box(extent[0], extent[2], extent[1], extent[3]))
+    return list(lakes.geometry.iloc[np.sort(within_bound)])
+
+
+@numba.njit(parallel=True, nogil=True, cache=True)
+def _exceedance_probabilities(gusts: np.ndarray, mesh_thres: float, line_thres: float) -> tuple[np.ndarray, np.ndarray]:
+    """Fused kernel computing the fraction of members exceeding both thresholds of gusts ordered (valid_time, eps, lat, lon)"""
+    nt, ne, ny, nx = gusts.shape
+    prob_mesh = np.zeros((nt, ny, nx), dtype=np.float32)
+    prob_line = np.zeros((nt, ny, nx), dtype=np.float32)
+    for t in numba.prange(nt):
+        for e in range(ne):
+            for j in range(ny):
+                for i in range(nx):
+                    if gusts[t, e, j, i] >= mesh_thres:
+                        prob_mesh[t, j, i] += 1.0
+                    if gusts[t, e, j, i] >= line_thres:
+                        prob_line[t, j, i] += 1.0
+    return prob_mesh / ne, prob_line / ne
+
+
+def add_overlay(ax, extent: list, lakes: list):
     """
     Overlay features, coordinate grid and set extent of plot
 
@@ -150,21 +290,18 @@ def add_overlay(ax, extent: list):
         Axes
     extent : str or list
         Set the plots extent with coordinates west, east, south, north]
+    lakes : list
+        Lake geometries within the extent, see `load_lakes`
     """
-
-    ch_lakes = gpd.read_file("/home/roman/projects/surfwetter-ml/src/lakes")
-    # Filter within view to speed up rendering
-    lakes_within_bound = ch_lakes.cx[extent[0] : extent[1], extent[2] : extent[3]]
-    if lakes_within_bound.empty:
+    if not lakes:
         ax.add_feature(cfeature.LAKES,
                        edgecolor='dodgerblue',
                        facecolor='#ffffff00')
     else:
-        ax.add_geometries(lakes_within_bound.geometry, crs=ccrs.PlateCarree(), facecolor="#ffffff00", edgecolor="dodgerblue")
+        ax.add_geometries(lakes, crs=_PC, facecolor="#ffffff00", edgecolor="dodgerblue")
 
     # Add points for surf spots
-    for site in CONFIG.forecast.sites:
-        ax.scatter(site.lon, site.lat, transform=ccrs.PlateCarree(), marker="*", c=["magenta"], label=site.name)
+    ax.scatter(_SITE_LONS, _SITE_LATS, transform=_PC, marker="*", c=["magenta"])
 
     # Overlay grid
     gl = ax.gridlines(draw_labels=True, color="#4c4c4c", linestyle=(0, (5, 5)))
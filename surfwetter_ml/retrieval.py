@@ -1,14 +1,23 @@
 import datetime as dt
+import functools
+import itertools
 import logging
+from collections import deque
+from collections.abc import Iterable
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
 from pathlib import Path
 from typing import Literal
 
 import click
 import isodate
+import numpy as np
 import xarray as xr
 from earthkit.data import config
 from meteodatalab import ogd_api
 from meteodatalab.operators import regrid
+from pyproj import Transformer
 from rasterio.crs import CRS
 
 from surfwetter_ml import CONFIG
@@ -17,73 +26,151 @@ from surfwetter_ml.util import write_forecast
 
 logger = logging.getLogger(__name__)
 
-# Set Cache for downloaded data
-config.set("cache-policy", "temporary")
-
-
-def get_api_request(model: Literal["ICON1", "ICON2"], init_time: dt.datetime, parameter: str, lead_time: int) -> list:
-    # Convert arguments to expected type for API
-    get_ref_time = init_time.strftime("%Y-%m-%dT%H:%M:%SZ")
-    get_lead_time = isodate.duration_isoformat(dt.timedelta(hours=lead_time))
-
-    control = ogd_api.Request(
-        collection=CONFIG.nwp.models[model].name,
-        variable=parameter,
-        reference_datetime=get_ref_time,
-        perturbed=False,
-        horizon=get_lead_time,
-    )
-    ensemble = ogd_api.Request(
-        collection=CONFIG.nwp.models[model].name,
-        variable=parameter,
-        reference_datetime=get_ref_time,
-        perturbed=True,
-        horizon=get_lead_time,
-    )
+# Set persistent cache for downloaded data, re-runs and the static ICON grid coordinates are then served from disk
+config.set("cache-policy", "user")
+config.set("user-cache-directory", str(Path(CONFIG.data, CONFIG.cache.directory)))
+config.set("maximum-cache-size", CONFIG.cache.max_size)
+
+DOWNLOAD_WORKERS = 8
+"""Number of concurrent downloads, kept low to respect the limits of the OGD API"""
+
+DOWNLOAD_QUEUE = DOWNLOAD_WORKERS * 2
+"""Number of downloads submitted ahead of processing, bounds the decoded fields held in memory"""
+
+
+# ISO 8601 durations of all lead times, indexed by hour
+_LEAD_ISO = tuple(
+    isodate.duration_isoformat(dt.timedelta(hours=hour)) for hour in range(max(CONFIG.nwp.models.ICON1.stop, CONFIG.nwp.models.ICON2.stop))
+)
+
+
+def get_request_template(model: Literal["ICON1", "ICON2"], init_time: dt.datetime, parameter: str) -> dict:
+    """Build the API request arguments shared by all lead times of a forecast
+
+    Parameters
+    ----------
+    model : Literal['ICON1', 'ICON2']
+        Model type, either 'ICON1' or 'ICON2'
+    init_time : dt.datetime
+        Initialization time
+    parameter : str
+        Forecast parameter
+
+    Returns
+    -------
+    dict
+        Keyword arguments for `ogd_api.Request` without perturbed and horizon
+    """
+    return {
+        "collection": CONFIG.nwp.models[model].name,
+        "variable": parameter,
+        "reference_datetime": init_time.strftime("%Y-%m-%dT%H:%M:%SZ"),
+    }
+
+
+def get_api_request(template: dict, lead_time: int) -> list:
+    # Convert lead time to expected type for API
+    get_lead_time = _LEAD_ISO[lead_time]
+
+    control = ogd_api.Request(**template, perturbed=False, horizon=get_lead_time)
+    ensemble = ogd_api.Request(**template, perturbed=True, horizon=get_lead_time)
     return [control, ensemble]
 
 
+def download_in_order(api_requests: Iterable[ogd_api.Request]) -> Iterator[xr.DataArray]:
+    """Download requests concurrently and yield the fields in request order. Only a bounded window of downloads is
+    submitted ahead, so fields do not pile up while processing lags and closing the generator, e.g. on a failed
+    download, cancels the queued downloads instead of waiting for them
+
+    Parameters
+    ----------
+    api_requests : Iterable[ogd_api.Request]
+        Requests to download
+
+    Yields
+    ------
+    xr.DataArray
+        Downloaded field of each request
+    """
+    api_requests = iter(api_requests)
+    with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as executor:
+        pending = deque(executor.submit(ogd_api.get_from_ogd, request) for request in itertools.islice(api_requests, DOWNLOAD_QUEUE))
+        try:
+            while pending:
+                future = pending.popleft()
+                for request in itertools.islice(api_requests, 1):
+                    pending.append(executor.submit(ogd_api.get_from_ogd, request))
+                yield future.result()
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
 def load_forecast(model: Literal["ICON1", "ICON2"], param: str, init_time: dt.datetime) -> xr.DataArray:
-    da_list = []
-    for lead_time in range(CONFIG.nwp.models[model].start, CONFIG.nwp.models[model].stop):
-        logger.info("Loading %s init %s param %s for lead-time %s", model, init_time.strftime(CONFIG.dtfmt), param, lead_time)
-        api_request = get_api_request(model, init_time, param, lead_time)
-        combined_da = build_forecast_step(api_request)  # Download data and combine ctrl with ensemble
-        da_list.append(regrid_forecast(combined_da, model))  # Re-project and reduce size
+    lead_times = range(CONFIG.nwp.models[model].start, CONFIG.nwp.models[model].stop)
+    template = get_request_template(model, init_time, param)
+    api_requests = [get_api_request(template, lead_time) for lead_time in lead_times]
+
+    # Download ctrl and ensemble of all lead-times concurrently, fields are returned in request order
+    destination = destination_grid(model)
+    init_str = init_time.strftime(CONFIG.dtfmt)
+    with closing(download_in_order(request for step_requests in api_requests for request in step_requests)) as downloads:
+        for idx, (lead_time, step_requests) in enumerate(zip(lead_times, api_requests, strict=True)):
+            combined_da = build_forecast_step([next(downloads) for _ in step_requests])  # Combine ctrl with ensemble
+            logger.info("Loaded %s init %s param %s for lead-time %s", model, init_str, param, lead_time)
+
+            # Allocate a single buffer with lead-time first, all lead-times share the ICON native grid
+            if idx == 0:
+                remap = remap_weights(combined_da, destination)
+                first_step = combined_da
+                step_dims = [dim for dim in combined_da.dims if dim not in ("lead_time", "cell")]
+                full_data = np.empty(
+                    (len(lead_times), *(combined_da.sizes[dim] for dim in step_dims), destination.ny, destination.nx), dtype=np.float32
+                )
+                lead_coords = {name: [] for name, coord in combined_da.coords.items() if "lead_time" in coord.dims}
+
+            # Re-project and reduce size
+            regrid_forecast(combined_da.isel(lead_time=0).transpose(*step_dims, "cell"), remap, full_data[idx])
+            for name, values in lead_coords.items():
+                values.append(combined_da[name].values)
 
     # Combine times, remove unused attributes, and convert to dataset
-    full_forecast = xr.concat(da_list, dim="lead_time")
-    del full_forecast.attrs["metadata"]
-    del full_forecast.attrs["parameter"]
-    del full_forecast.attrs["geography"]
+    _, _, lon, lat = remap
+    coords = {name: coord for name, coord in first_step.coords.items() if name not in lead_coords and "cell" not in coord.dims}
+    for name, values in lead_coords.items():
+        coords[name] = (first_step[name].dims, np.concatenate(values, axis=first_step[name].get_axis_num("lead_time")))
+    coords.update(lon=(("y", "x"), lon), lat=(("y", "x"), lat))
+    full_forecast = xr.DataArray(full_data, dims=("lead_time", *step_dims, "y", "x"), coords=coords, attrs=first_step.attrs)
+    for attr in ("metadata", "parameter", "geography"):
+        full_forecast.attrs.pop(attr, None)
     return full_forecast
 
 
-def build_forecast_step(requests: list) -> xr.DataArray:
-    # Load forecast data
-    da_list = []
-    for request in requests:
-        da = ogd_api.get_from_ogd(request)
-        da_list.append(da)
-
-    # Combine control & ensemble
-    return xr.concat(da_list, dim="eps")
+def build_forecast_step(da_list: list[xr.DataArray]) -> xr.DataArray:
+    # Combine control & ensemble, stacking the raw arrays as all other coordinates are shared
+    da_list = [da if "eps" in da.dims else da.expand_dims("eps") for da in da_list]
+    first = da_list[0]
+    axis = first.get_axis_num("eps")
+    data = np.concatenate([da.transpose(*first.dims).values for da in da_list], axis=axis)
+    coords = {name: coord for name, coord in first.coords.items() if "eps" not in coord.dims}
+    for name, coord in first.coords.items():
+        if "eps" in coord.dims:
+            coords[name] = (coord.dims, np.concatenate([da[name].values for da in da_list], axis=coord.get_axis_num("eps")))
+    return xr.DataArray(data, dims=first.dims, coords=coords, attrs=first.attrs)
 
 
-def regrid_forecast(data: xr.DataArray, model: Literal["ICON1", "ICON2"]) -> xr.DataArray:
-    """Re-grid forecast to WGS84
+@functools.lru_cache(maxsize=2)
+def destination_grid(model: Literal["ICON1", "ICON2"]) -> regrid.RegularGrid:
+    """Build the regular WGS84 target grid of a model, shared by all lead times and parameters
 
     Parameters
     ----------
-    data : xr.DataArray
-        Input data
     model : Literal['ICON1', 'ICON2']
         Model type, either 'ICON1' or 'ICON2'
 
     Returns
     -------
-    xr.DataArray
-        Re-gridded data
+    regrid.RegularGrid
+        Target grid
     """
     # Define the target grid extent and resolution
     xmin, xmax = CONFIG.nwp.regrid.xmin, CONFIG.nwp.regrid.xmax
@@ -92,14 +179,65 @@ def regrid_forecast(data: xr.DataArray, model: Literal["ICON1", "ICON2"]) -> xr.
     nx, ny = round((xmax - xmin) / distance), round((ymax - ymin) / distance)  # Number of grid points in x and y
 
     # Create a regular lat/lon grid using EPSG:4326
-    destination = regrid.RegularGrid(CRS.from_string("epsg:4326"), nx+1, ny+1, xmin, xmax, ymin, ymax)
+    return regrid.RegularGrid(CRS.from_string("epsg:4326"), nx+1, ny+1, xmin, xmax, ymin, ymax)
 
-    # Remap ICON native grid data to the regular grid
-    return regrid.iconremap(data, destination)
 
+# `remap_weights` and `regrid_forecast` follow the private `regrid._linear_weights_cropped_domain` and
+# `regrid._icon2regular` of meteodata-lab 0.3.0, re-sync them and `test_regrid_forecast` when upgrading meteodata-lab
+def remap_weights(data: xr.DataArray, destination: regrid.RegularGrid) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Compute the barycentric interpolation from the ICON native grid to the target grid once for all lead times,
+    following `regrid.iconremap` which triangulates the ICON grid on every call
+
+    Parameters
+    ----------
+    data : xr.DataArray
+        Input data on the ICON native grid
+    destination : regrid.RegularGrid
+        Target grid, see `destination_grid`
+
+    Returns
+    -------
+    tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]
+        Interpolation indices and weights as well as longitudes and latitudes of the target grid
+    """
+    # Interpolate in UTM zone 32N like meteodatalab
+    to_utm = Transformer.from_crs("epsg:4326", "epsg:32632", always_xy=True)
+    points_src = np.array(to_utm.transform(data.lon, data.lat)).T
+
+    gx, gy = np.meshgrid(destination.x, destination.y)
+    destination_to_utm = Transformer.from_crs(destination.crs.wkt, "epsg:32632", always_xy=True)
+    points_dst = np.array(destination_to_utm.transform(gx.flat, gy.flat)).T
+
+    indices, weights = regrid._linear_weights_cropped_domain(points_src, points_dst)
+    lon, lat = Transformer.from_crs(destination.crs.wkt, "epsg:4326", always_xy=True).transform(gx, gy)
+    return indices, weights, lon, lat
 
-def get_latest_init(model: Literal["ICON1", "ICON2"]) -> dt.datetime:
-    """Function to get the latest available model initialization by attempting to download a CTRL run
+
+def regrid_forecast(data: xr.DataArray, remap: tuple, out: np.ndarray) -> None:
+    """Re-grid forecast to WGS84 directly into a preallocated array, following `regrid._icon2regular`
+
+    Parameters
+    ----------
+    data : xr.DataArray
+        Input data, with the ICON native grid as last dimension
+    remap : tuple
+        Interpolation from the ICON native grid to the target grid, see `remap_weights`
+    out : np.ndarray
+        C-contiguous array receiving the re-gridded data, with the target grid y and x as last dimensions
+    """
+    # Interpolate from the vertices of the enclosing triangle, bounded by their values
+    indices, weights, _, _ = remap
+    values = np.take(data.values, indices, axis=-1)
+    result = out.reshape(*out.shape[:-2], -1)  # View of out with the target grid flattened
+    np.einsum("...ij,ij->...i", values, weights, out=result, casting="same_kind")
+    np.clip(result, values.min(axis=-1), values.max(axis=-1), out=result)
+
+    # Points outside of the ICON domain
+    result[..., ~np.all(indices != 0, axis=-1)] = np.nan
+
+
+def latest_possible_init(model: Literal["ICON1", "ICON2"]) -> dt.datetime:
+    """Derive the latest possible forecast based on the model initialization frequency
 
     Parameters
     ----------
@@ -111,17 +249,58 @@ def get_latest_init(model: Literal["ICON1", "ICON2"]) -> dt.datetime:
     dt.datetime
         Initialization time
     """
-
-    # Derive the latest possible forecast based on the model initialization frequency
     utc_now = dt.datetime.now(dt.UTC).replace(minute=0, second=0, microsecond=0)
     hour_remainder = utc_now.hour % CONFIG.nwp.models[model].freq
     if hour_remainder == 0:
-        test_init = utc_now
-    else:
-        test_init = utc_now - dt.timedelta(hours=hour_remainder)
+        return utc_now
+    return utc_now - dt.timedelta(hours=hour_remainder)
+
+
+def missing_parameters(model: Literal["ICON1", "ICON2"], init_time: dt.datetime) -> list[str]:
+    """Find the parameters of a forecast which are not yet stored on disk
+
+    Parameters
+    ----------
+    model : Literal['ICON1', 'ICON2']
+        Model type, either 'ICON1' or 'ICON2'
+    init_time : dt.datetime
+        Initialization time
+
+    Returns
+    -------
+    list[str]
+        Parameters to download
+    """
+    init_str = init_time.strftime(CONFIG.dtfmt)
+    store_dir = Path(CONFIG.data, init_str)
+    missing = []
+    for param in CONFIG.nwp.parameters:
+        full_path = Path(store_dir, f"{model}-{init_str}-{param}.nc")
+        if Path.is_file(full_path):
+            logger.warning("File %s already dowloaded, skipping!", full_path)
+        else:
+            missing.append(param)
+    return missing
+
+
+def get_latest_init(model: Literal["ICON1", "ICON2"]) -> dt.datetime:
+    """Function to get the latest available model initialization by attempting to download a CTRL run
+
+    Parameters
+    ----------
+    model : Literal['ICON1', 'ICON2']
+        Model type, either 'ICON1' or 'ICON2'
+
+    Returns
+    -------
+    dt.datetime
+        Initialization time
+    """
+    test_init = latest_possible_init(model)
 
     # Build API request for the last timestep of the model init to test
-    test_request = get_api_request(model, test_init, CONFIG.nwp.parameters[0], CONFIG.nwp.models[model].stop - 1)
+    test_template = get_request_template(model, test_init, CONFIG.nwp.parameters[0])
+    test_request = get_api_request(test_template, CONFIG.nwp.models[model].stop - 1)
     try:
         _ = ogd_api.get_from_ogd(test_request[0])
         return test_init
@@ -135,21 +314,31 @@ def get_latest_init(model: Literal["ICON1", "ICON2"]) -> dt.datetime:
 @click.option("--model", "-m", default="ICON1")
 @click.option("--init", "-i", default=dt.datetime.now(tz=dt.UTC).replace(hour=0, minute=0, second=0, microsecond=0).strftime(CONFIG.dtfmt))
 def process_forecast(model: Literal["ICON1", "ICON2"], init: str):
-    if init == "latest":
-        init_time = get_latest_init(model)
-    else:
-        init_time = dt.datetime.strptime(init, CONFIG.dtfmt)
+    init_time = latest_possible_init(model) if init == "latest" else dt.datetime.strptime(init, CONFIG.dtfmt)
 
-    for param in CONFIG.nwp.parameters:
-        # Skip files which are already available
-        store_dir = Path(CONFIG.data, init_time.strftime(CONFIG.dtfmt))
-        full_path = Path(store_dir, f"{model}-{init_time.strftime(CONFIG.dtfmt)}-{param}.nc")
-        if Path.is_file(full_path):
-            logger.warning("File %s already dowloaded, skipping!", full_path)
-            continue
-        da = load_forecast(model, param, init_time)
-        ds = da_to_ds(da, param)
-        write_forecast(ds, model, param, init_time)
+    # Skip files which are already available, only probing the API when the latest possible forecast is not complete on disk
+    params = missing_parameters(model, init_time)
+    if params and init == "latest":
+        latest_init = get_latest_init(model)
+        if latest_init != init_time:
+            init_time = latest_init
+            params = missing_parameters(model, init_time)
+    if not params:
+        logger.info("All parameters of %s init %s already available", model, init_time.strftime(CONFIG.dtfmt))
+        return
+
+    # Write each param in the background while the next one downloads, waiting for the previous write bounds memory to two params
+    pending = None
+    with ThreadPoolExecutor(max_workers=1) as writer:
+        for param in params:
+            da = load_forecast(model, param, init_time)
+            ds = da_to_ds(da, param)
+            del da  # Only keep the re-ordered copy while it is written
+            if pending is not None:
+                pending.result()
+            pending = writer.submit(write_forecast, ds, model, param, init_time)
+        if pending is not None:
+            pending.result()  # Raise errors of the last write
 
 
 if __name__ == "__main__":
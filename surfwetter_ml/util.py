@@ -1,10 +1,12 @@
 import datetime as dt
+import functools
 import json
 import logging
 from pathlib import Path
 from typing import Literal
 
 import geopandas as gpd
+import hdf5plugin
 import numpy as np
 import pandas as pd
 import pytz
@@ -15,55 +17,133 @@ from surfwetter_ml import CONFIG
 
 logger = logging.getLogger(__name__)
 
+NETCDF_COORD_ENCODING = {coord: {"dtype": np.double} for coord in ("ref_time", "valid_time", "lead_time", "eps")}
+"""Encoding of the time and ensemble coordinates present in a forecast"""
+
+NETCDF_CHUNKS = {"valid_time": 24, "lat": 32, "lon": 32}
+"""On-disk chunk sizes, all ensemble members of a grid point are kept in the same chunk to read site columns cheaply"""
+
+NETCDF_COMPRESSION = dict(hdf5plugin.Blosc2(cname="zstd", clevel=1, filters=hdf5plugin.Blosc2.SHUFFLE))
+"""Blosc2/Zstd HDF5 filter, importing hdf5plugin with this module registers it for all readers of the package"""
+
+NETCDF_PRECISION = {"VMAX_10M": 0.01, "U_10M": 0.01, "V_10M": 0.01, "WIND_SPEED": 0.01, "WIND_DIR": 0.1, "T_2M": 0.01}
+"""Physical precision kept when packing a parameter, accumulated fields are absent as de-accumulation amplifies quantization"""
+
+PLOT_MIRRORS = frozenset({("ICON1", "VMAX_10M")})
+"""Forecasts additionally stored as uncompressed uint8 for plotting, rain is excluded for the reason given at `NETCDF_PRECISION`"""
+
 
 def write_forecast(data: xr.Dataset, model: Literal["ICON1", "ICON2"], param: str, init_time: dt.datetime) -> None:
     # Store file on disk
-    store_dir = Path(CONFIG.data, init_time.strftime(CONFIG.dtfmt))
-    Path(store_dir).mkdir(parents=True, exist_ok=True)
+    store_dir = store_directory(init_time)
+    init_str = store_dir.name
 
-    # test writing to zarr
-    # file_name = f"{store_dir}/{model}-{init_time.strftime(CONFIG.dtfmt)}-{param}.zarr"
+    # test writing to zarr, not enabled as all readers open the forecasts as netCDF through h5netcdf
+    # file_name = f"{store_dir}/{model}-{init_str}-{param}.zarr"
     # ds.to_zarr(file_name)
 
-    file_name = f"{store_dir}/{model}-{init_time.strftime(CONFIG.dtfmt)}-{param}.nc"
+    file_name = f"{store_dir}/{model}-{init_str}-{param}.nc"
     logger.info("Writing %s to disk", file_name)
 
     # Define datatypes
-    encoding_dict = {}
-    coord_names = list(data.coords)
-    if "ref_time" in coord_names:
-        encoding_dict["ref_time"] = {"dtype": np.double}
-    if "valid_time" in coord_names:
-        encoding_dict["valid_time"] = {"dtype": np.double}
-    if "lead_time" in coord_names:
-        encoding_dict["lead_time"] = {"dtype": np.double}
-    if "eps" in coord_names:
-        encoding_dict["eps"] = {"dtype": np.double}
-
-    # Use float32 and compress param
-    for variable in list(data.data_vars):
-        encoding_dict[variable] = {"dtype": np.float32, "zlib": True}
+    encoding_dict = {coord: dict(encoding) for coord, encoding in NETCDF_COORD_ENCODING.items() if coord in data.coords}
+
+    # Pack param to int16 and compress with a fast multi-threaded compressor, chunked along the read pattern
+    chunks = {}
+    for variable in data.data_vars:
+        chunks[variable] = tuple(min(NETCDF_CHUNKS.get(dim, size), size) for dim, size in data[variable].sizes.items())
+        packing = pack_integer(data[variable], "int16", NETCDF_PRECISION.get(param))
+        encoding_dict[variable] = {**packing, **NETCDF_COMPRESSION, "chunksizes": chunks[variable]}
 
     data.to_netcdf(path=file_name, engine="h5netcdf", encoding=encoding_dict)
 
+    # Store a coarsely packed copy which is faster to read for plotting
+    if (model, param) in PLOT_MIRRORS:
+        for variable in data.data_vars:
+            encoding_dict[variable] = {**pack_integer(data[variable], "uint8"), "chunksizes": chunks[variable]}
+        data.to_netcdf(path=file_name.replace(".nc", ".plot.nc"), engine="h5netcdf", encoding=encoding_dict)
+
+
+@functools.lru_cache(maxsize=4)
+def store_directory(init_time: dt.datetime) -> Path:
+    """Create the directory holding all files of a model initialization, once for all parameters written
+
+    Parameters
+    ----------
+    init_time : dt.datetime
+        Initialization time
+
+    Returns
+    -------
+    Path
+        Directory named after the formatted initialization time
+    """
+    store_dir = Path(CONFIG.data, init_time.strftime(CONFIG.dtfmt))
+    store_dir.mkdir(parents=True, exist_ok=True)
+    return store_dir
+
+
+def pack_integer(data: xr.DataArray, dtype: Literal["int16", "uint8"], precision: float | None = None) -> dict:
+    """Derive the encoding to store a variable as integers with scale factor and offset, the integer furthest from zero is
+    reserved for missing values
+
+    Parameters
+    ----------
+    data : xr.DataArray
+        Variable to pack
+    dtype : Literal['int16', 'uint8']
+        Integer type to pack to
+    precision : float | None, optional
+        Finest step between packed values, a coarser step than needed for the value range leaves fewer distinct integers
+        which compress better, by default None
+
+    Returns
+    -------
+    dict
+        NetCDF encoding of the variable
+    """
+    # Range of packed values, e.g. -32767 to 32767 for int16 and 0 to 254 for uint8
+    info = np.iinfo(dtype)
+    fill_value = info.min if info.min < 0 else info.max
+    lowest, highest = (info.min + 1, info.max) if info.min < 0 else (0, info.max - 1)
+
+    vmin, vmax = float(data.min()), float(data.max())
+    if not np.isfinite(vmin):
+        # All values missing
+        scale, offset = 1.0, 0.0
+    elif vmax == vmin:
+        # Constant field
+        scale, offset = 1.0, vmin
+    else:
+        # Map the value range onto the full range of packed values, unless it is finer than the precision required
+        scale = max((vmax - vmin) / (highest - lowest), precision or 0.0)
+        offset = vmin - lowest * scale
+    return {
+        "dtype": dtype,
+        "scale_factor": np.float32(scale),
+        "add_offset": np.float32(offset),
+        "_FillValue": np.array(fill_value, dtype=dtype),
+    }
+
 
 def da_to_ds(data: xr.DataArray, param: str) -> xr.Dataset:
     logger.info("Converting dataarray to dataset for %s", param)
     # Strip unnecessary dimensions and re-order
     data = data.squeeze()
-    data = data.transpose("lead_time", "eps", "y", "x")
+    if data.dims != ("lead_time", "eps", "y", "x"):
+        data = data.transpose("lead_time", "eps", "y", "x", transpose_coords=False)
 
-    # Generate nice dataset
+    # Generate nice dataset, materializing the re-ordered values exactly once in the layout written to disk
     ds = xr.Dataset(
         {
-            param: (("valid_time", "eps", "lat", "lon"), data.data),
+            param: (("valid_time", "eps", "lat", "lon"), np.ascontiguousarray(data.values)),
         },
         coords={
-            "valid_time": data.valid_time.data,
-            "eps": data.eps.data,
-            "lat": data.lat[:, 0].data,
-            "lon": data.lon[0].data,
-            "ref_time": data.ref_time.data,
+            "valid_time": data.valid_time.values,
+            "eps": data.eps.values,
+            "lat": data.lat.values[:, 0].copy(),
+            "lon": data.lon.values[0].copy(),
+            "ref_time": data.ref_time.values,
         },
     )
 
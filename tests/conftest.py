@@ -0,0 +1,5 @@
+import os
+from pathlib import Path
+
+# Settings of the test suite, set before surfwetter_ml is imported and loads its configuration
+os.environ.setdefault("SURFWETTER_CONFIG", str(Path(__file__).with_name("config.yaml")))
@@ -0,0 +1,42 @@
+import shutil
+from pathlib import Path
+
+import pytest
+import surfwetter_ml
+from surfwetter_ml import load_config
+
+CONFIG_FILE = Path(__file__).with_name("config.yaml")
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    """Empty cache directory of parsed settings"""
+    monkeypatch.setattr(surfwetter_ml, "CACHE_DIR", tmp_path / "cache")
+    return tmp_path / "cache"
+
+
+def test_load_config_cached(cache_dir):
+    settings = load_config(CONFIG_FILE)
+    assert len(list(cache_dir.glob("config-*.pkl"))) == 1
+    assert load_config(CONFIG_FILE) == settings
+
+
+def test_load_config_broken_cache(cache_dir):
+    settings = load_config(CONFIG_FILE)
+    for cache_file in cache_dir.glob("config-*.pkl"):
+        cache_file.write_bytes(b"not a pickle")
+    assert load_config(CONFIG_FILE) == settings
+
+
+def test_load_config_settings_changed(cache_dir, tmp_path, monkeypatch):
+    load_config(CONFIG_FILE)
+
+    # Any change of the settings classes invalidates the cache
+    root_dir = tmp_path / "surfwetter_ml"
+    Path(root_dir, "config").mkdir(parents=True)
+    shutil.copy(Path(surfwetter_ml.ROOT_DIR, "config", "setting.py"), Path(root_dir, "config"))
+    with Path(root_dir, "config", "setting.py").open("a") as f:
+        f.write("\n# changed\n")
+    monkeypatch.setattr(surfwetter_ml, "ROOT_DIR", str(root_dir))
+    load_config(CONFIG_FILE)
+    assert len(list(cache_dir.glob("config-*.pkl"))) == 2
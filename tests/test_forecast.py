@@ -0,0 +1,151 @@
+import logging
+import os
+import warnings
+from pathlib import Path
+
+import msgspec
+import numpy as np
+import pytest
+import xarray as xr
+from surfwetter_ml import CONFIG
+from surfwetter_ml import forecast
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    """Empty data directory and cache of latest forecasts"""
+    monkeypatch.setattr(CONFIG, "data", str(tmp_path / "data"))
+    monkeypatch.setattr(forecast, "CACHE_DIR", tmp_path / "cache")
+    Path(CONFIG.data).mkdir()
+    return Path(CONFIG.data)
+
+
+def store(data_dir: Path, model: str, init: str, params: list[str]) -> None:
+    """Create empty forecast files of a model initialization"""
+    Path(data_dir, init).mkdir(exist_ok=True)
+    for param in params:
+        Path(data_dir, init, f"{model}-{init}-{param}.nc").touch()
+
+
+def test_lookup_latest_forecast(data_dir):
+    store(data_dir, "ICON2", "202506010000", CONFIG.nwp.parameters)
+    store(data_dir, "ICON1", "202506010600", CONFIG.nwp.parameters)
+    store(data_dir, "ICON2", "202506010600", CONFIG.nwp.parameters[:1])  # Incomplete
+    store(data_dir, "ICON1", "202506010900", CONFIG.nwp.parameters[:1])  # Incomplete
+    Path(data_dir, "lakes").mkdir()
+
+    assert forecast.lookup_latest_forecast() == ("202506010600", "202506010000")
+
+
+def test_lookup_latest_forecast_cache(data_dir, caplog):
+    store(data_dir, "ICON1", "202506010600", CONFIG.nwp.parameters)
+    store(data_dir, "ICON2", "202506010600", CONFIG.nwp.parameters)
+    store(data_dir, "ICON1", "202506010900", CONFIG.nwp.parameters[:1])  # Download in progress
+    for folder in [data_dir, *data_dir.iterdir()]:
+        os.utime(folder, ns=(0, 0))  # Ensure completing the download changes the modification time
+
+    assert forecast.lookup_latest_forecast() == ("202506010600", "202506010600")
+    with caplog.at_level(logging.INFO):
+        assert forecast.lookup_latest_forecast() == ("202506010600", "202506010600")
+    assert "(cached)" in caplog.text
+
+    # Completing a forecast inside an existing folder invalidates the cache
+    store(data_dir, "ICON1", "202506010900", CONFIG.nwp.parameters)
+    assert forecast.lookup_latest_forecast() == ("202506010900", "202506010600")
+
+
+def test_is_init_folder():
+    assert forecast.is_init_folder("202506010600")
+    assert not forecast.is_init_folder("2025060106")
+    assert not forecast.is_init_folder("lakes")
+
+
+@pytest.mark.parametrize("quantiles", [[0.5], [0.0, 0.1, 0.25, 0.5, 0.75, 0.9, 1.0]])
+def test_ensemble_quantiles(quantiles):
+    rng = np.random.default_rng(0)
+    data = rng.normal(size=(24, 5, 21)).astype(np.float32)
+    data[rng.random(data.shape) < 0.2] = np.nan  # Some missing members
+    data[0, 0] = np.nan  # All members missing
+    data[0, 1, 1:] = np.nan  # Single valid member
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)  # All-NaN slice
+        expected = np.moveaxis(np.nanquantile(data, quantiles, axis=-1), 0, -1)
+    result = forecast.ensemble_quantiles(data, quantiles)
+
+    np.testing.assert_allclose(result, expected, rtol=1e-5, atol=1e-6)
+    assert np.isnan(result[0, 0]).all()
+    np.testing.assert_array_equal(result[0, 1], data[0, 1, 0])
+
+
+
+def write_grid(path: Path, model: str) -> xr.Dataset:
+    """Write the coordinates of the regular grid of a model to a forecast file"""
+    distance = CONFIG.nwp.models[model].distance
+    lon = np.arange(CONFIG.nwp.regrid.xmin, CONFIG.nwp.regrid.xmax + distance / 2, distance)
+    lat = np.arange(CONFIG.nwp.regrid.ymin, CONFIG.nwp.regrid.ymax + distance / 2, distance)
+    grid = xr.Dataset(coords={"lon": lon, "lat": lat})
+    grid.to_netcdf(path, engine="h5netcdf")
+    return grid
+
+
+def nearest_points(grid: xr.Dataset, site) -> list[tuple[int, int]]:
+    """Indices of the grid points selected by xarray nearest-neighbour lookup"""
+    lons = site.lon if isinstance(site.lon, list) else [site.lon]
+    lats = site.lat if isinstance(site.lat, list) else [site.lat]
+    return [
+        (grid.lon.to_index().get_loc(grid.lon.sel(lon=x, method="nearest").item()), grid.lat.to_index().get_loc(grid.lat.sel(lat=y, method="nearest").item()))
+        for x, y in zip(lons, lats, strict=True)
+    ]
+
+
+def test_locate_sites(tmp_path, monkeypatch):
+    monkeypatch.setattr(forecast, "_GRID_POINTS", {})
+    sites = CONFIG.forecast.sites
+    grid = write_grid(Path(tmp_path, "grid.nc"), "ICON2")
+
+    grid_points = forecast.locate_sites("ICON2", Path(tmp_path, "grid.nc"), sites)
+    assert grid_points == {site.name: nearest_points(grid, site) for site in sites}
+
+    # Moving a site or changing the model grid must not reuse cached indices
+    moved = msgspec.structs.replace(sites[0], lon=sites[0].lon + 0.5)
+    assert forecast.locate_sites("ICON2", Path(tmp_path, "grid.nc"), [moved]) == {moved.name: nearest_points(grid, moved)}
+    monkeypatch.setattr(CONFIG.nwp.regrid, "xmin", CONFIG.nwp.regrid.xmin + 0.55)
+    grid = write_grid(Path(tmp_path, "cropped.nc"), "ICON2")
+    assert forecast.locate_sites("ICON2", Path(tmp_path, "cropped.nc"), sites) == {site.name: nearest_points(grid, site) for site in sites}
+
+
+class ClosedFTP:
+    """FTP session whose connection was closed by the server"""
+
+    def __init__(self):
+        self.calls = []
+
+    def voidcmd(self, cmd):
+        self.calls.append(cmd)
+        raise EOFError
+
+    def close(self):
+        self.calls.append("close")
+
+    def connect(self, host):
+        self.calls.append("connect")
+
+    def login(self, user, password):
+        self.calls.append("login")
+
+
+def test_keep_alive():
+    ftp_server = ClosedFTP()
+    forecast.keep_alive(ftp_server)
+    assert ftp_server.calls == ["NOOP", "close", "connect", "login"]
+
+
+def test_locate_sites_tie(tmp_path, monkeypatch):
+    monkeypatch.setattr(forecast, "_GRID_POINTS", {})
+    grid = xr.Dataset(coords={"lon": np.arange(8.0, 9.0, 0.25), "lat": np.arange(46.5, 47.5, 0.25)})
+    grid.to_netcdf(Path(tmp_path, "grid.nc"), engine="h5netcdf")
+    site = msgspec.structs.replace(CONFIG.forecast.sites[0], lon=8.375, lat=46.875)  # Exactly between two grid points
+
+    grid_points = forecast.locate_sites("ICON2", Path(tmp_path, "grid.nc"), [site])
+    assert grid_points == {site.name: nearest_points(grid, site)}
@@ -0,0 +1,39 @@
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+from surfwetter_ml import CONFIG
+from surfwetter_ml import plot
+
+
+def test_exceedance_probabilities():
+    rng = np.random.default_rng(0)
+    values = rng.uniform(0, 30, size=(6, 11, 8, 9)).astype(np.float32)
+    values[rng.random(values.shape) < 0.2] = np.nan  # Missing members never exceed
+    values[0, :, 0, 0] = np.nan  # All members missing
+    values[1, :, 0, 0] = 14  # Exactly at the threshold
+    gusts = xr.DataArray(values, dims=("valid_time", "eps", "lat", "lon"))
+
+    exceed_mesh, exceed_line = plot._exceedance_probabilities(values, 14, 20)
+
+    for result, thres in [(exceed_mesh, 14), (exceed_line, 20)]:
+        expected = (gusts >= thres).sum("eps") / gusts.sizes["eps"]
+        np.testing.assert_allclose(result, expected, rtol=1e-6)
+    assert exceed_mesh[0, 0, 0] == 0
+    assert exceed_mesh[1, 0, 0] == 1
+    assert exceed_line[1, 0, 0] == 0
+
+
+def test_plot_mismatched_valid_times(tmp_path, monkeypatch):
+    monkeypatch.setattr(CONFIG, "data", str(tmp_path))
+    init = "202506010600"
+    Path(tmp_path, init).mkdir()
+    for param, steps in [("VMAX_10M", 30), ("TOT_PREC", 34)]:  # Partially written gust mirror
+        coords = {"valid_time": pd.date_range("2025-06-01 06:00", periods=steps, freq="h"), "eps": range(11), "lat": [46.9], "lon": [8.6]}
+        data = xr.Dataset({param: (("valid_time", "eps", "lat", "lon"), np.ones((steps, 11, 1, 1), dtype=np.float32))}, coords=coords)
+        data.to_netcdf(Path(tmp_path, init, f"ICON1-{init}-{param}.nc"), engine="h5netcdf")
+
+    with pytest.raises(ValueError, match="different valid times"):
+        plot.plot_ICON1(init, "urnersee")
@@ -0,0 +1,53 @@
+import time
+
+import numpy as np
+import pytest
+import xarray as xr
+from meteodatalab.operators import regrid
+from surfwetter_ml import retrieval
+
+
+def test_regrid_forecast(monkeypatch):
+    # Synthetic ICON grid not covering the whole target grid
+    rng = np.random.default_rng(0)
+    ncells = 20000
+    field = xr.DataArray(
+        rng.normal(10, 5, size=(3, 1, ncells)).astype(np.float32),
+        dims=("eps", "lead_time", "cell"),
+        coords={"lon": ("cell", rng.uniform(6, 10.5, ncells)), "lat": ("cell", rng.uniform(46, 47.5, ncells))},
+    )
+    destination = retrieval.destination_grid("ICON2")
+
+    # The synthetic field has no GRIB metadata to update
+    monkeypatch.setattr(regrid, "_get_metadata", lambda dst: {})
+    expected = regrid.iconremap(field, destination).isel(lead_time=0)
+
+    out = np.empty((3, destination.ny, destination.nx), dtype=np.float32)
+    remap = retrieval.remap_weights(field, destination)
+    retrieval.regrid_forecast(field.isel(lead_time=0), remap, out)
+
+    assert np.isnan(expected.values).any()
+    np.testing.assert_allclose(out, expected.transpose("eps", "y", "x").values, rtol=1e-6)
+    np.testing.assert_allclose(remap[2], expected.lon.values)
+    np.testing.assert_allclose(remap[3], expected.lat.values)
+
+
+
+def test_download_in_order(monkeypatch):
+    submitted = []
+
+    def get_from_ogd(request):
+        submitted.append(request)
+        time.sleep(0.001 * (request % 3))  # Downloads finish out of order
+        if request == 40:
+            raise RuntimeError("Download failed")
+        return request
+
+    monkeypatch.setattr(retrieval.ogd_api, "get_from_ogd", get_from_ogd)
+    assert list(retrieval.download_in_order(range(40))) == list(range(40))
+
+    # A failed download stops further submissions, only the window queued ahead has been started
+    submitted.clear()
+    with pytest.raises(RuntimeError, match="Download failed"):
+        list(retrieval.download_in_order(range(200)))
+    assert len(submitted) <= 41 + retrieval.DOWNLOAD_QUEUE
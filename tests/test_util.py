@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+import xarray as xr
+from surfwetter_ml.util import pack_integer
+
+
+def round_trip(data: xr.DataArray, encoding: dict, path) -> xr.DataArray:
+    """Write a variable with the given encoding and read it back"""
+    data.to_dataset(name="param").to_netcdf(path, engine="h5netcdf", encoding={"param": encoding})
+    with xr.open_dataset(path, engine="h5netcdf") as ds:
+        return ds.param.load()
+
+
+@pytest.mark.parametrize("dtype", ["int16", "uint8"])
+def test_pack_integer(dtype, tmp_path):
+    rng = np.random.default_rng(0)
+    data = xr.DataArray(rng.uniform(-5, 40, size=(24, 11, 8)).astype(np.float32), dims=("valid_time", "eps", "lat"))
+    data[0, 0, 0] = np.nan
+
+    encoding = pack_integer(data, dtype)
+    result = round_trip(data, encoding, tmp_path / "packed.nc")
+
+    np.testing.assert_array_equal(np.isnan(result), np.isnan(data))
+    np.testing.assert_allclose(result, data, atol=encoding["scale_factor"] * 0.51)
+    assert float(result.min()) == pytest.approx(float(data.min()), abs=encoding["scale_factor"])
+    assert float(result.max()) == pytest.approx(float(data.max()), abs=encoding["scale_factor"])
+
+
+@pytest.mark.parametrize("dtype", ["int16", "uint8"])
+def test_pack_integer_constant(dtype, tmp_path):
+    data = xr.DataArray(np.full((4, 3), 12.5, dtype=np.float32), dims=("valid_time", "eps"))
+    data[0, 0] = np.nan
+
+    result = round_trip(data, pack_integer(data, dtype), tmp_path / "packed.nc")
+
+    np.testing.assert_array_equal(result, data)
+
+
+def test_pack_integer_missing(tmp_path):
+    data = xr.DataArray(np.full((4, 3), np.nan, dtype=np.float32), dims=("valid_time", "eps"))
+
+    result = round_trip(data, pack_integer(data, "int16"), tmp_path / "packed.nc")
+
+    assert np.isnan(result).all()
+
+
+def test_pack_integer_precision(tmp_path):
+    data = xr.DataArray(np.linspace(0, 30, 1000, dtype=np.float32), dims="valid_time")
+
+    encoding = pack_integer(data, "int16", precision=0.01)
+    result = round_trip(data, encoding, tmp_path / "packed.nc")
+
+    assert encoding["scale_factor"] == np.float32(0.01)
+    np.testing.assert_allclose(result, data, atol=0.0051)
+
+    # A precision finer than the packed range allows is ignored
+    assert pack_integer(data, "int16", precision=1e-6)["scale_factor"] == pack_integer(data, "int16")["scale_factor"]